@@ -32,11 +32,14 @@ from .optimizers.adam import adam
 # Loss Functions
 from .losses.mean_squared_error import mean_squared_error
 from .losses.categorical_cross_entropy import categorical_cross_entropy
+from .losses.sparse_categorical_cross_entropy import sparse_categorical_cross_entropy
+from .losses.sparse_softmax_cross_entropy import sparse_softmax_cross_entropy
 from .losses.binary_cross_entropy import binary_cross_entropy
 
 # Image processing functionality
 from .data_processing.image_utils import save_grayscale_image, upscale_grayscale_image, scale_grayscale_image, translate_grayscale_image, \
-    noisify_grayscale_image, rotate_grayscale_image, zoom_grayscale_image, save_rbg_image
+    noisify_grayscale_image, rotate_grayscale_image, zoom_grayscale_image, save_rbg_image, \
+    affine_transform_grayscale_image, transform_grayscale_image
 
 # Saving and loading weights from file
 from .data_processing.file_io import save_params, load_params
@@ -1,21 +1,125 @@
 import jax.numpy as jnp
-from jax.image import scale_and_translate, resize
-from jax import jit, random
+from jax.image import scale_and_translate
+from jax.scipy.ndimage import map_coordinates
+from jax import jit, random, vmap
 from jax import Array
 from jax.random import PRNGKey
 from jax.typing import ArrayLike
-# Deep mind library that provides jax compatible image processing functions
-from dm_pix import rotate, resize_with_crop_or_pad
 # For image debugging
 from PIL import Image as im
 import numpy as np
 
+def _check_image_dimensions(device_array: ArrayLike):
+    """Raise a ValueError unless device_array is an image (2 dimensions) or a batch of images (more than 2 dimensions)."""
+    if len(device_array.shape) < 2:
+        raise ValueError("Array shape {} dimensions, but expected at least 2 dimensions.".format(len(device_array.shape)))
+
+def _affine_matrix(row_0, row_1) -> Array:
+    """Build homogeneous 3x3 matrices from the first two rows of an affine transform.
+
+    Each entry can be a scalar or an array with one value per image. So the result has shape (3, 3) or (..., 3, 3).
+    """
+    row_0, row_1 = jnp.broadcast_arrays(jnp.stack(jnp.broadcast_arrays(*row_0), axis=-1), jnp.stack(jnp.broadcast_arrays(*row_1), axis=-1))
+    row_2 = jnp.broadcast_to(jnp.array([0.0, 0.0, 1.0]), row_0.shape)
+    return jnp.stack([row_0, row_1, row_2], axis=-2)
+
+# The matrices below map the coordinates of an output pixel back to the input pixel that is sampled.
+# The center of an image is ((height - 1) / 2, (width - 1) / 2) in pixel coordinates.
+def _zoom_matrix(shape, zoom_factor: float) -> Array:
+    inverse_zoom = 1 / jnp.asarray(zoom_factor, dtype=jnp.float32)
+    center_row, center_col = (shape[-2] - 1) / 2, (shape[-1] - 1) / 2
+    return _affine_matrix(
+        (inverse_zoom, 0.0, center_row - center_row * inverse_zoom),
+        (0.0, inverse_zoom, center_col - center_col * inverse_zoom),
+    )
+
+def _translation_matrix(vertical_shift: float, horizontal_shift: float) -> Array:
+    return _affine_matrix(
+        (1.0, 0.0, -jnp.asarray(vertical_shift, dtype=jnp.float32)),
+        (0.0, 1.0, -jnp.asarray(horizontal_shift, dtype=jnp.float32)),
+    )
+
+def _rotation_matrix(shape, angle_degrees: float) -> Array:
+    # Need to convert the angle in degrees to radians. Because that is what the trigonometric functions accept.
+    angle = jnp.asarray(angle_degrees, dtype=jnp.float32) * (jnp.pi / 180)
+    cos, sin = jnp.cos(angle), jnp.sin(angle)
+    center_row, center_col = (shape[-2] - 1) / 2, (shape[-1] - 1) / 2
+    return _affine_matrix(
+        (cos, sin, center_row - cos * center_row - sin * center_col),
+        (-sin, cos, center_col + sin * center_row - cos * center_col),
+    )
+
+def affine_transform_grayscale_image(device_array: ArrayLike, matrix: ArrayLike) -> Array:
+    """Apply an affine transform to jax images for experimentation and debugging.
+
+    The matrix maps the (row, col, 1) coordinates of each output pixel to the input coordinates that are sampled.
+    The input is sampled with bilinear interpolation, and pixels sampled from outside of the image are 0.
+
+    Args:
+        device_array: 2 dimensional jax array, or a batch of images with any number of leading dimensions (e.g. 3 dimensional).
+        matrix: A (2, 3) affine matrix, or a (..., 2, 3) array that broadcasts against the leading dimensions of device_array.
+            Homogeneous (3, 3) matrices are also accepted.
+
+    Example:
+        Usage for mnist. Shift the image down 2 pixels::
+
+        image_array = jnp.reshape(train_images[0] * 256, (28,28))
+        image_array = affine_transform_grayscale_image(image_array, jnp.array([[1, 0, -2], [0, 1, 0]]))
+
+    Returns:
+        jax_array: The transformed image as an array.
+    """
+    _check_image_dimensions(device_array)
+    height, width = device_array.shape[-2:]
+    rows, cols = jnp.meshgrid(jnp.arange(height, dtype=jnp.float32), jnp.arange(width, dtype=jnp.float32), indexing='ij')
+    grid = jnp.stack([rows, cols, jnp.ones_like(rows)], axis=-1)
+    # Transform the coordinates of every output pixel with a single einsum. (..., 2, 3) x (height, width, 3) -> (..., height, width, 2)
+    coords = jnp.einsum('...ij,hwj->...hwi', jnp.asarray(matrix)[..., :2, :], grid)
+
+    # Flatten any leading dimensions into a single batch dimension, then vmap a 2 dimensional map_coordinates over it.
+    # The batch index is not passed as a third coordinate. With bilinear interpolation that would gather 8 neighbours per pixel instead of 4.
+    images = jnp.reshape(device_array, (-1, height, width))
+    coords = jnp.broadcast_to(coords, (*device_array.shape, 2)).reshape((*images.shape, 2))
+    out = vmap(lambda image, image_coords: map_coordinates(image, [image_coords[..., 0], image_coords[..., 1]], order=1, mode='constant'))(images, coords)
+    return jnp.reshape(out, device_array.shape)
+
+def transform_grayscale_image(device_array: ArrayLike, zoom_factor: float = 1, vertical_shift: float = 0,
+                              horizontal_shift: float = 0, angle_degrees: float = 0) -> Array:
+    """Zoom, translate and then rotate jax images for experimentation and debugging.
+
+    This gives the same result as calling zoom_grayscale_image, translate_grayscale_image and rotate_grayscale_image in that order.
+    However, the three transforms are composed into a single affine matrix per image. So the image is only interpolated once.
+
+    Args:
+        device_array: 2 dimensional jax array, or a batch of images with any number of leading dimensions (e.g. 3 dimensional).
+        zoom_factor: The multiplier used to zoom the image. Can be less than or greater than 1.
+        vertical_shift: Positive values shift down. Negative values shift up.
+        horizontal_shift: Positive values shift right. Negative values shift left.
+        angle_degrees: The angle (in degrees) to rotate the image counter-clockwise.
+        For a batch of images each of the above can also be an array that broadcasts against the leading dimensions.
+
+    Example:
+        Usage for mnist. Make contents of image 25% smaller, shift right and up, then rotate 45 degrees::
+
+        image_array = jnp.reshape(train_images[0] * 256, (28,28))
+        image_array = transform_grayscale_image(image_array, 0.75, -3, 3, 45)
+
+    Returns:
+        jax_array: The transformed image as an array.
+    """
+    _check_image_dimensions(device_array)
+    shape = device_array.shape
+    # The matrices map output coordinates back to input coordinates. So the transforms are composed in reverse order.
+    matrix = _zoom_matrix(shape, zoom_factor) @ _translation_matrix(vertical_shift, horizontal_shift) @ _rotation_matrix(shape, angle_degrees)
+    return affine_transform_grayscale_image(device_array, matrix)
+
 def zoom_grayscale_image(device_array: ArrayLike, zoom_factor: float) -> Array:
     """Zoom jax images for experimentation and debugging.
 
     Args:
-        device_array: 2 dimensional jax array.
+        device_array: 2 dimensional jax array, or a batch of images with any number of leading dimensions (e.g. 3 dimensional).
         zoom_factor: The multiplier used to zoom the image. Can be less than or greater than 1.
+            For a batch of images this can also be an array that broadcasts against the leading dimensions.
 
     Example:
         Usage for mnist. Make contents of image 25% smaller::
@@ -26,19 +130,18 @@ def zoom_grayscale_image(device_array: ArrayLike, zoom_factor: float) -> Array:
     Returns:
         jax_array: The zoomed image as an array.
     """
-    out = resize(device_array, (round(device_array.shape[0] * zoom_factor), round(device_array.shape[1] * zoom_factor)), 'nearest')
-    # Greyscale to 3 channel image. https://stackoverflow.com/questions/40119743/convert-a-grayscale-image-to-a-3-channel-image
-    stacked_img = jnp.stack((out,)*3, axis=-1)
-    out = resize_with_crop_or_pad(stacked_img, device_array.shape[0], device_array.shape[1])
-    out = jnp.reshape(out[:,:,:1], (device_array.shape[0],device_array.shape[1]))
-    return out
+    # Scale about the center of the image so the output keeps the input shape.
+    # Sampling the coordinates (instead of resizing then cropping) means zoom_factor can be a traced value under jit.
+    _check_image_dimensions(device_array)
+    return affine_transform_grayscale_image(device_array, _zoom_matrix(device_array.shape, zoom_factor))
 
 def rotate_grayscale_image(device_array: ArrayLike, angle_degrees: float) -> Array:
     """Rotate jax images for experimentation and debugging.
 
     Args:
-        device_array: 2 dimensional jax array.
-        angle: The angle (in degrees) to rotate the image.
+        device_array: 2 dimensional jax array, or a batch of images with any number of leading dimensions (e.g. 3 dimensional).
+        angle: The angle (in degrees) to rotate the image counter-clockwise.
+            For a batch of images this can also be an array that broadcasts against the leading dimensions.
 
     Example:
         Usage for mnist. Rotate image 45 degrees::
@@ -49,11 +152,8 @@ def rotate_grayscale_image(device_array: ArrayLike, angle_degrees: float) -> Arr
     Returns:
         jax_array: The rotated image as an array.
     """
-    stacked_img = jnp.stack((device_array,)*3, axis=-1)
-    # Need to convert the angle in degrees to radians. Because that is what the rotate function accepts.
-    out = rotate(stacked_img, angle=(angle_degrees * (jnp.pi / 180)))
-    out = jnp.reshape(out[:,:,:1], (device_array.shape[0],device_array.shape[1]))
-    return out
+    _check_image_dimensions(device_array)
+    return affine_transform_grayscale_image(device_array, _rotation_matrix(device_array.shape, angle_degrees))
 
 def noisify_grayscale_image(rng: PRNGKey, device_array: ArrayLike, num_noise_iterations: int = 5,
                             percentage_noise: float = 0.5, noise_value_low: float = 0, noise_value_high: float = 255) -> Array:
@@ -63,7 +163,8 @@ def noisify_grayscale_image(rng: PRNGKey, device_array: ArrayLike, num_noise_ite
     This means for each noise iteration, a noise value can be applied to multiple pixels based on the percentage.
 
     Args:
-        device_array: 2 dimensional jax array.
+        device_array: 2 dimensional jax array, or a batch of images with any number of leading dimensions (e.g. 3 dimensional).
+            Each image in a batch picks its own noise values.
         rng (PRNGKey): The PRNGKey to pull random values from.
         num_noise_iterations: The number of unique noise values applied to the image.
         percentage_noise: The percentage chance that a single noise value replaces a pixel in the image.
@@ -81,12 +182,14 @@ def noisify_grayscale_image(rng: PRNGKey, device_array: ArrayLike, num_noise_ite
         jax_array: The noisified image as an array.
     """
     frac = percentage_noise / 100
+    # One noise value per image. For a single 2 dimensional image this is shape (1, 1).
+    noise_value_shape = (*device_array.shape[:-2], 1, 1)
     # Each iteration only applies a single noise value (possibly multiple times).
     # So typically you want a really low noise percentage and a higher number of iterations.
     # That way you get a bunch of unique noise values applied a small number of times.
     for _ in range(num_noise_iterations):
         rng, noise_rng = random.split(rng)
-        random_int = random.uniform(noise_rng, (1,), minval=noise_value_low, maxval=noise_value_high)
+        random_int = random.uniform(noise_rng, noise_value_shape, minval=noise_value_low, maxval=noise_value_high)
         device_array = jnp.where(random.uniform(noise_rng, device_array.shape) > frac, device_array, random_int)
     return device_array
 
@@ -94,9 +197,11 @@ def translate_grayscale_image(device_array: ArrayLike, vertical_shift: float, ho
     """Translate jax images for experimentation and debugging.
 
     Args:
-        device_array: 2 dimensional jax array.
+        device_array: 2 dimensional jax array, or a batch of images with any number of leading dimensions (e.g. 3 dimensional).
         vertical_shift: Positive values shift down. Negative values shift up.
+            For a batch of images this can also be an array that broadcasts against the leading dimensions.
         horizontal_shift: Positive values shift right. Negative values shift left.
+            For a batch of images this can also be an array that broadcasts against the leading dimensions.
 
     Example:
         Usage for mnist. Shift right and up::
@@ -107,17 +212,8 @@ def translate_grayscale_image(device_array: ArrayLike, vertical_shift: float, ho
     Returns:
         jax_array: The translated image as an array.
     """
-    if len(device_array.shape) != 2:
-        raise ValueError("Array shape {} dimensions, but expected 2 dimensions.".format(len(device_array.shape)))
-    
-    return scale_and_translate(
-        device_array,
-        shape=device_array.shape,
-        spatial_dims=(0, 1),
-        translation=jnp.array([vertical_shift, horizontal_shift]),
-        scale=jnp.array([1, 1]),
-        method='linear'
-    )
+    _check_image_dimensions(device_array)
+    return affine_transform_grayscale_image(device_array, _translation_matrix(vertical_shift, horizontal_shift))
 
 def scale_grayscale_image(device_array: ArrayLike, scale_factor: float, method='linear') -> Array:
     """Scale jax images (up or down) for experimentation and debugging. This function utilizes interpolation for resizing the image.
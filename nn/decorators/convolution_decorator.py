@@ -17,28 +17,28 @@ def debug_decorator(convolution_debug: Callable[P, R]) -> Callable[P, R]:
     """
     Decorator to wrap the Convolutional layer.
     """
+    if logging.getLevelName(logging.root.level) != "INFO2":
+        return convolution_debug
+
     @functools.wraps(convolution_debug)
     def GeneralConv(*args: P.args, **kwargs: P.kwargs) -> R:
-        if logging.getLevelName(logging.root.level) == "INFO2":
-            init_fun_debug, apply_fun_debug = convolution_debug(*args, **kwargs)
-
-            @functools.wraps(init_fun_debug)
-            def init_fun(rng, input_shape):
-                output_shape, (weights, bias), state = init_fun_debug(rng, input_shape)
-                debug_msg = "Conv(Input Shape: {}, Output Shape: {}) => Weight Shape: {}, Bias Shape: {}".format(input_shape, output_shape, weights.shape, bias.shape)
-                debug_msg = debug_msg.replace("-1", "*")
-                jax.debug.print(debug_msg)
-                return output_shape, (weights, bias), state
-            
-            @functools.wraps(apply_fun_debug)
-            def apply_fun(params, state, inputs, **kwargs):
-                weights, bias = params
-                result, state = apply_fun_debug(params, state, inputs, **kwargs)
-                jax.debug.print("I{} * W{} + B{} = Output Shape: {}".format(inputs.shape, weights.shape, bias.shape, result.shape))
-                return result, state
+        init_fun_debug, apply_fun_debug = convolution_debug(*args, **kwargs)
 
-            return init_fun, apply_fun
-        else:
-            return convolution_debug(*args, **kwargs)
+        @functools.wraps(init_fun_debug)
+        def init_fun(rng, input_shape):
+            output_shape, (weights, bias), state = init_fun_debug(rng, input_shape)
+            debug_msg = "Conv(Input Shape: {}, Output Shape: {}) => Weight Shape: {}, Bias Shape: {}".format(input_shape, output_shape, weights.shape, bias.shape)
+            debug_msg = debug_msg.replace("-1", "*")
+            jax.debug.print(debug_msg)
+            return output_shape, (weights, bias), state
         
+        @functools.wraps(apply_fun_debug)
+        def apply_fun(params, state, inputs, **kwargs):
+            weights, bias = params
+            result, state = apply_fun_debug(params, state, inputs, **kwargs)
+            jax.debug.print("I{} * W{} + B{} = Output Shape: {}".format(inputs.shape, weights.shape, bias.shape, result.shape))
+            return result, state
+
+        return init_fun, apply_fun
+
     return GeneralConv
\ No newline at end of file
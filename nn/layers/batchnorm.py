@@ -60,6 +60,10 @@ def BatchNorm(axis=(0, 1, 2), epsilon=1e-5, center=True, scale=True, beta_init=z
                 var = ((x - mean) ** 2).mean(axis=(0, 1, 2), keepdims=True)
             # In training mode, the current mean and variance are used
             X_hat = (x - mean) / jnp.sqrt(var + epsilon)
+            if len(x.shape) == 4:
+                # Drop the kept dimensions again, so the moving statistics keep their (channels,) shape from init_fun.
+                # Otherwise the states change shape after the first step (which breaks lax.scan carries and causes a recompile).
+                mean, var = jnp.squeeze(mean, axis=(0, 1, 2)), jnp.squeeze(var, axis=(0, 1, 2))
             # Update the mean and variance using moving average
             moving_mean = momentum * moving_mean + (1.0 - momentum) * mean
             moving_var = momentum * moving_var + (1.0 - momentum) * var
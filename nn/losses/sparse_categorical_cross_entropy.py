@@ -0,0 +1,11 @@
+import jax.numpy as jnp
+from jax.typing import ArrayLike
+from jax import Array
+
+
+def sparse_categorical_cross_entropy(predictions: ArrayLike, targets: ArrayLike) -> Array:
+    # The targets are integer class ids of shape (batch_size,) instead of one-hot vectors.
+    # So the log probability of the target class is gathered directly.
+    negative_log_likelihood = jnp.take_along_axis(predictions, jnp.expand_dims(targets, axis=1), axis=1)
+    cross_entropy = -jnp.mean(negative_log_likelihood)
+    return cross_entropy
@@ -0,0 +1,13 @@
+import jax.numpy as jnp
+from jax.scipy.special import logsumexp
+from jax.typing import ArrayLike
+from jax import Array
+
+
+def sparse_softmax_cross_entropy(logits: ArrayLike, targets: ArrayLike) -> Array:
+    # The logits are the raw network outputs, so the network should not end in a LogSoftmax layer.
+    # The targets are integer class ids of shape (batch_size,).
+    # logsumexp(logits) - logits[target] is the negative log softmax of the target class, without computing the full log softmax first.
+    target_logits = jnp.take_along_axis(logits, jnp.expand_dims(targets, axis=1), axis=1)[:, 0]
+    cross_entropy = jnp.mean(logsumexp(logits, axis=1) - target_logits)
+    return cross_entropy
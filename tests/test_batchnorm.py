@@ -0,0 +1,33 @@
+"""Regression checks for the BatchNorm moving statistics.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import unittest
+import jax
+import jax.numpy as jnp
+from nn import serial, Dense, Conv, BatchNorm, Relu
+
+
+class BatchNormStatesTest(unittest.TestCase):
+
+    def test_dense_batchnorm_train_apply(self):
+        # The moving statistics of a BatchNorm after a Dense layer take the shape of the features after a train step.
+        init_fun, apply_fun = serial(Dense(8), BatchNorm(), Relu, Dense(2))
+        _, params, states = init_fun(jax.random.PRNGKey(0), (-1, 4))
+        outputs, states = apply_fun(params, states, jnp.ones((3, 4)), rng=jax.random.PRNGKey(1))
+        moving_mean, moving_var = states[1]
+        self.assertEqual(outputs.shape, (3, 2))
+        self.assertEqual(moving_mean.shape, (8,))
+        self.assertEqual(moving_var.shape, (8,))
+
+    def test_conv_batchnorm_states_keep_their_shape(self):
+        # After a convolution the moving statistics keep the (channels,) shape from init, so they can be carried through lax.scan.
+        init_fun, apply_fun = serial(Conv(4, (3, 3), padding="SAME"), BatchNorm(), Relu)
+        _, params, states = init_fun(jax.random.PRNGKey(0), (-1, 6, 6, 1))
+        _, new_states = apply_fun(params, states, jnp.ones((2, 6, 6, 1)), rng=jax.random.PRNGKey(1))
+        self.assertEqual(jax.tree_util.tree_map(jnp.shape, new_states), jax.tree_util.tree_map(jnp.shape, states))
+        self.assertEqual(new_states[1][0].shape, (4,))
+
+
+if __name__ == "__main__":
+    unittest.main()
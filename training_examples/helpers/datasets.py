@@ -63,16 +63,23 @@ def mnist_raw():
 
     return train_images, train_labels, test_images, test_labels
 
-def mnist(permute_train=False):
-    """Download, parse and process MNIST data to unit scale and one-hot labels."""
+def mnist(permute_train=False, one_hot=True):
+    """Download, parse and process MNIST data to unit scale and one-hot labels.
+
+    If one_hot is False, the labels are instead returned as int32 class ids of shape (N,).
+    This uses a tenth of the memory and avoids an argmax to recover the class in the loss and accuracy."""
     print("Loading MNIST Dataset")
 
     train_images, train_labels, test_images, test_labels = mnist_raw()
 
     train_images = _partial_flatten(train_images) / np.float32(255.0)
     test_images = _partial_flatten(test_images) / np.float32(255.0)
-    train_labels = _one_hot(train_labels, 10)
-    test_labels = _one_hot(test_labels, 10)
+    if one_hot:
+        train_labels = _one_hot(train_labels, 10)
+        test_labels = _one_hot(test_labels, 10)
+    else:
+        train_labels = train_labels.astype(np.int32)
+        test_labels = test_labels.astype(np.int32)
 
     if permute_train:
         perm = np.random.RandomState(0).permutation(train_images.shape[0])
@@ -0,0 +1,47 @@
+"""Background prefetching for the data streams used in examples."""
+
+import queue
+import threading
+import jax
+
+# Marks the end of a finite iterator.
+_END = object()
+
+def prefetch(iterator, size=2):
+    """Prepare the next batches of an iterator on a background thread.
+
+    The background thread keeps up to ``size`` batches ready while the training loop consumes them.
+    So the work of producing batch i+1 (e.g. data augmentation) overlaps with the update step of batch i.
+
+    Args:
+        iterator: An iterator that yields batches of jax arrays (or pytrees of jax arrays).
+        size: The maximum number of batches that are prepared ahead of time.
+
+    Example:
+        Usage with a data stream::
+
+        batches = prefetch(data_stream(rng))
+        batch = next(batches)
+
+    Returns:
+        A generator that yields the same batches as ``iterator``.
+    """
+    batch_queue = queue.Queue(maxsize=size)
+
+    def producer():
+        try:
+            for batch in iterator:
+                # Move the batch to the device and wait for it to finish computing on this thread, rather than on the training loop.
+                batch_queue.put(jax.block_until_ready(jax.device_put(batch)))
+        except Exception as error:
+            batch_queue.put(error)
+        batch_queue.put(_END)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        batch = batch_queue.get()
+        if batch is _END:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
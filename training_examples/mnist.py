@@ -9,6 +9,7 @@ from tqdm import trange
 import itertools
 import jax.numpy as jnp
 from jax import jit, grad, random
+from jax.tree_util import tree_map
 import training_examples.helpers.datasets as datasets
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
@@ -73,8 +74,11 @@ def main():
         def loss(params, states, batch):
             """Calculates the loss of the network as a single value / float"""
             inputs, targets = batch
+            # The forward and backward passes run in bfloat16, which halves the bytes moved by the Dense matmuls.
+            # The optimizer still holds float32 master weights, and the gradients are cast back to float32 by the astype.
+            params, inputs = tree_map(lambda x: x.astype(jnp.bfloat16), (params, inputs))
             predictions, states = net_predict(params, states, inputs)
-            return categorical_cross_entropy(predictions, targets), states
+            return categorical_cross_entropy(predictions.astype(jnp.float32), targets), states
 
         params = get_params(opt_state)
         grads, states = grad(loss, has_aux=True)(params, states, batch)
@@ -8,10 +8,10 @@ sys.path.append("..")
 import training_examples.helpers.tqdm_config # pyright: ignore
 from tqdm import trange
 
-import itertools
 import jax.numpy as jnp
-from jax import jit, grad, random
+from jax import jit, value_and_grad, random
 import training_examples.helpers.datasets as datasets
+from training_examples.helpers.prefetch import prefetch
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 import jax
@@ -19,33 +19,59 @@ from functools import partial
 from nn import *
 
 
-def accuracy(params, states, batch):
+@jit
+def correct_predictions(params, states, batch):
+    """Calculates the number of correct guesses for a given batch"""
     inputs, targets = batch
-    target_class = jnp.argmax(targets, axis=1)
+    # The targets are already class ids, so only the predictions need an argmax.
     predicted_class = jnp.argmax(net_predict(params, states, inputs)[0], axis=1)
-    return jnp.mean(predicted_class == target_class)
+    return jnp.sum(predicted_class == targets)
 
+def accuracy(params, states, batch, chunk_size=1000):
+    """Calculates accuracy (or percentage of correct guesses) for a given batch.
+
+    The batch is evaluated in chunks of chunk_size, so large datasets do not have to fit through the network at once."""
+    inputs, targets = batch
+    correct = sum(correct_predictions(params, states, (inputs[i : i + chunk_size], targets[i : i + chunk_size]))
+                  for i in range(0, inputs.shape[0], chunk_size))
+    return correct / inputs.shape[0]
+
+@jit
 def augment(rng, batch):
-    # Generate the same number of keys as the array size. In this case, 5.
-    subkeys = random.split(rng, batch.shape[0])
-    # Calculate random degrees between -20 and 20
-    random_angles = jax.vmap(lambda x: jax.random.uniform(x, minval=-20, maxval=20), in_axes=(0), out_axes=0)(subkeys)
-    random_vertical_shifts = jax.vmap(lambda x: jax.random.uniform(x, minval=-3, maxval=3), in_axes=(0), out_axes=0)(subkeys)
-    random_horizontal_shifts = jax.vmap(lambda x: jax.random.uniform(x, minval=-3, maxval=3), in_axes=(0), out_axes=0)(subkeys)
-
-    # Each batch uses the same fixed zoom value. This is a limitation due to vmap not allowing dynamically shaped arrays.
-    random_zoom = jax.random.uniform(subkeys[0], minval=0.75, maxval=1.45)
-    # random_zoom = float(random_zoom) # if you want to jit the zoom function
-    zoom_grayscale_image_fixed = partial(zoom_grayscale_image, zoom_factor=random_zoom)
-
-    batch = jnp.reshape(batch * 255, (batch.shape[0], 28,28))
-    # batch = jax.vmap(jit(zoom_grayscale_image_fixed), in_axes=(0), out_axes=0)(batch) # if you want to jit the zoom function
-    batch = jax.vmap(zoom_grayscale_image_fixed, in_axes=(0), out_axes=0)(batch)
-    batch = jax.vmap(jit(translate_grayscale_image), in_axes=(0,0,0), out_axes=0)(batch, random_vertical_shifts, random_horizontal_shifts)
-    batch = jax.vmap(jit(rotate_grayscale_image), in_axes=(0,0), out_axes=0)(batch, random_angles)
-    batch = jax.vmap(jit(noisify_grayscale_image), in_axes=(0,0), out_axes=0)(subkeys, batch)
-    batch = jnp.reshape(batch / 255, (batch.shape[0], 28, 28, 1))
-    return batch
+    """Randomly augments a batch of images of shape (B, 28, 28, 1).
+
+    augment is jitted at module level, so it is only traced once per batch shape. The rng is always a key of the same shape and dtype,
+    so new keys do not cause a retrace and later calls dispatch straight to the compiled executable."""
+    transform_rng, zoom_rng, noise_rng = random.split(rng, 3)
+    # Draw every per-image random value with a single call. Each row is (angle, vertical shift, horizontal shift).
+    # Angles are between -20 and 20 degrees and shifts are between -3 and 3 pixels.
+    random_transforms = jax.random.uniform(transform_rng, (batch.shape[0], 3), minval=jnp.array([-20, -3, -3]), maxval=jnp.array([20, 3, 3]))
+    random_angles, random_vertical_shifts, random_horizontal_shifts = random_transforms.T
+
+    # Each batch uses the same zoom value. The zoom stays a traced scalar so it is compiled into the same graph.
+    random_zoom = jax.random.uniform(zoom_rng, minval=0.75, maxval=1.45)
+
+    # The whole function is jitted, so the individual augmentations are not wrapped in jit.
+    # The image functions accept a batch of images directly, so no vmap is needed over the batch.
+    # The zoom, translation and rotation are composed into one affine transform per image, so the batch is only interpolated once.
+    # The images stay in the [0, 1] range, so the noise values are drawn from that range too.
+    # The channel dimension is only dropped for the grayscale functions and added back afterwards. There is no rescaling or reshaping.
+    images = transform_grayscale_image(batch[..., 0], random_zoom, random_vertical_shifts, random_horizontal_shifts, random_angles)
+    images = noisify_grayscale_image(noise_rng, images, noise_value_high=1)
+    return images[..., None]
+
+@partial(jit, static_argnums=(2,))
+def augment_dataset(rng, images, chunk_size):
+    """Augments a whole dataset of shape (N, 28, 28, 1).
+
+    The images are augmented chunk_size images at a time with lax.map. So the intermediate arrays are only ever the size of a single chunk."""
+    num_chunks = images.shape[0] // chunk_size
+    subkeys = random.split(rng, num_chunks + 1)
+    chunks = images[: num_chunks * chunk_size].reshape(num_chunks, chunk_size, *images.shape[1:])
+    augmented = jax.lax.map(lambda key_and_chunk: augment(*key_and_chunk), (subkeys[:-1], chunks))
+    # Augment any images that do not fill a whole chunk separately.
+    leftover = augment(subkeys[-1], images[num_chunks * chunk_size :])
+    return jnp.concatenate([augmented.reshape(-1, *images.shape[1:]), leftover])
 
 net_init, net_predict = model_decorator(
     serial(
@@ -55,7 +81,9 @@ net_init, net_predict = model_decorator(
         MaxPool((2, 2), strides=(2, 2)),
         Flatten,
         Dense(84), Elu,
-        Dense(10), LogSoftmax,
+        # There is no LogSoftmax layer. The network outputs logits, which go straight into sparse_softmax_cross_entropy.
+        # The argmax of the logits is the same as the argmax of the log probabilities, so the accuracy is unchanged.
+        Dense(10),
     )
 )
 
@@ -66,62 +94,87 @@ def main():
     num_epochs = 5
     batch_size = 128
     momentum_mass = 0.9
+    # Each augmented copy of the training set is reused (with a new shuffle) for this many epochs.
+    # Higher values spend less time augmenting, at the cost of the network seeing the same augmented images more often.
+    epochs_per_augmentation = 2
     # IMPORTANT
-    # If your network is larger and you test against the entire dataset for the accuracy.
-    # Then you will run out of RAM and get a std::bad_alloc error.
+    # If your network is larger and you test against the entire dataset for the accuracy in one pass.
+    # Then you will run out of RAM and get a std::bad_alloc error. So the accuracy is calculated in chunks of this size.
     accuracy_batch_size = 1000
+    # The accuracy is only calculated on the first accuracy_subset_size images of the train and test sets, to keep each epoch fast.
+    # Set it to None to evaluate the entire datasets. The evaluation is chunked, so it still fits in memory, but it takes a lot longer.
+    accuracy_subset_size = 1000
 
-    train_images, train_labels, test_images, test_labels = datasets.mnist()
+    train_images, train_labels, test_images, test_labels = datasets.mnist(one_hot=False)
     num_train = train_images.shape[0]
-    num_complete_batches, leftover = divmod(num_train, batch_size)
-    num_batches = num_complete_batches + bool(leftover)
+    # Only complete batches are used, so every batch of an epoch stacks into a single array for lax.scan.
+    # The leftover images are different every epoch because of the shuffle.
+    num_batches = num_train // batch_size
 
     train_images = jnp.reshape(train_images, (train_images.shape[0], 28, 28, 1))
     test_images = jnp.reshape(test_images, (test_images.shape[0], 28, 28, 1))
+    # Keep the labels on device as well. Indexing the numpy labels with the on-device permutation copies the indices back to the host every batch.
+    train_labels = jnp.asarray(train_labels)
 
     def data_stream(rng):
-        # Need to modify this np_rng to be jax PRNG
+        # The key is only split once. Every epoch then derives its keys with fold_in, which is a single cheap op instead of a full split.
+        augment_rng, permutation_rng = random.split(rng)
+        epoch = 0
         while True:
-            rng, subkey = random.split(rng)
-            perm = random.permutation(subkey, num_train)
-            for i in range(num_batches):
-                # batch_idx is a list of indices.
-                # That means this function yields an array of training images equal to the batch size when 'next' is called.
-                batch_idx = perm[i * batch_size : (i + 1) * batch_size]
-                # Augment the training data using key.
-                rng, subkey = jax.random.split(rng)
-                train_images_aug = augment(subkey, train_images[batch_idx])
-                yield train_images_aug, train_labels[batch_idx]
-
-    batches = data_stream(rng)
+            # Augment the training data using key. The augmented copy is kept on device and reused for several epochs.
+            augmented_images = augment_dataset(random.fold_in(augment_rng, epoch), train_images, batch_size)
+            for _ in range(epochs_per_augmentation):
+                # The permutation is generated on device every epoch, so the batches are gathered without leaving the device.
+                perm = random.permutation(random.fold_in(permutation_rng, epoch), num_train)[: num_batches * batch_size]
+                epoch += 1
+                # Each call to 'next' yields all of the batches for an epoch, stacked with shape (num_batches, batch_size, ...).
+                images = jnp.take(augmented_images, perm, axis=0).reshape(num_batches, batch_size, 28, 28, 1)
+                labels = jnp.take(train_labels, perm, axis=0).reshape(num_batches, batch_size)
+                yield images, labels
+
+    # Prepare the next epoch (and augment the next copy of the training set) on a background thread while the current epoch is training.
+    epochs = prefetch(data_stream(rng), size=1)
 
     opt_init, opt_update, get_params = momentum(step_size, mass=momentum_mass)
 
-    @jit
     def update(i, opt_state, states, batch):
+        # The step counter i is a device scalar that is incremented here. So there is no host side counter to send every step.
         def loss(params, states, batch):
             """Calculates the loss of the network as a single value / float"""
             inputs, targets = batch
             predictions, states = net_predict(params, states, inputs)
-            return categorical_cross_entropy(predictions, targets), states
+            return sparse_softmax_cross_entropy(predictions, targets), states
 
         params = get_params(opt_state)
-        grads, states = grad(loss, has_aux=True)(params, states, batch)
-        return opt_update(i, grads, opt_state), states
+        # The loss value is computed by the same forward pass as the gradients, so returning it for logging is free.
+        (loss_value, states), grads = value_and_grad(loss, has_aux=True)(params, states, batch)
+        return i + 1, opt_update(i, grads, opt_state), states, loss_value
+
+    # The old optimizer state is never used after an update, so its buffers are donated to the new optimizer state.
+    @partial(jit, donate_argnums=(1,))
+    def train_epoch(i, opt_state, states, batches):
+        """Runs update over every batch of an epoch with lax.scan. So the whole epoch is a single call into XLA."""
+        def train_step(carry, batch):
+            i, opt_state, states = carry
+            i, opt_state, states, loss_value = update(i, opt_state, states, batch)
+            return (i, opt_state, states), loss_value
+
+        (i, opt_state, states), losses = jax.lax.scan(train_step, (i, opt_state, states), batches)
+        return i, opt_state, states, losses[-1]
 
     _, init_params, states = net_init(rng, (-1, 28, 28, 1))
     opt_state = opt_init(init_params)
-    itercount = itertools.count()
+    step = jnp.array(0, dtype=jnp.int32)
 
     print("Starting training...")
     for epoch in (t := trange(num_epochs)):
-        for batch in range(num_batches):
-            opt_state, states = update(next(itercount), opt_state, states, next(batches))
+        step, opt_state, states, loss_value = train_epoch(step, opt_state, states, next(epochs))
 
         params = get_params(opt_state)
-        train_acc = accuracy(params, states, (train_images[:accuracy_batch_size], train_labels[:accuracy_batch_size]))
-        test_acc = accuracy(params, states, (test_images[:accuracy_batch_size], test_labels[:accuracy_batch_size]))
+        train_acc = accuracy(params, states, (train_images[:accuracy_subset_size], train_labels[:accuracy_subset_size]), accuracy_batch_size)
+        test_acc = accuracy(params, states, (test_images[:accuracy_subset_size], test_labels[:accuracy_subset_size]), accuracy_batch_size)
         t.set_description_str("Accuracy Train = {:.2%}, Accuracy Test = {:.2%}".format(train_acc, test_acc))
+        t.set_postfix_str("Loss = {:.4f}".format(loss_value))
     print("Training Complete.")
 
     # Visual Debug After Training
@@ -140,17 +193,21 @@ def visual_debug(params, states, test_images, test_labels, starting_index=0, row
         
         def render_images(self):
             rng = kwargs['rng']
-            i = self.starting_index
+            # Augment and predict every displayed image with a single batch, rather than one image at a time.
+            # The indices wrap around, so paging before the first image or past the last image still works.
+            indices = jnp.arange(self.starting_index, self.starting_index + (rows * columns)) % test_images.shape[0]
+            augmented_images = augment(rng, jnp.take(test_images, indices, axis=0))
+            output = net_predict(params, states, augmented_images)[0]
+            # Copy the results to the host once. The loop below only does plotting.
+            augmented_images, predictions, targets = jax.device_get((augmented_images, jnp.argmax(output, axis=1), jnp.take(test_labels, indices)))
+            i = 0
             for j in range(rows):
                 for k in range(columns):
-                    rng, subkey = random.split(rng)
-                    augmented_image = augment(subkey, test_images[i].reshape(1, *test_images[i].shape))
-                    output = net_predict(params, states, augmented_image)[0]
-                    prediction = int(jnp.argmax(output, axis=1)[0])
-                    target = int(jnp.argmax(test_labels[i], axis=0))
+                    prediction = int(predictions[i])
+                    target = int(targets[i])
                     prediction_color = "green" if prediction == target else "red"
                     axes[j][k].set_title(prediction, color=prediction_color)
-                    axes[j][k].imshow(augmented_image.reshape(28, 28), cmap='gray')
+                    axes[j][k].imshow(augmented_images[i].reshape(28, 28), cmap='gray')
                     axes[j][k].get_xaxis().set_visible(False)
                     axes[j][k].get_yaxis().set_visible(False)
                     i += 1
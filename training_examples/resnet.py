@@ -1,7 +1,7 @@
 """A Resnet example for CIFAR-10. 
 
 It achieves around 90% accuracy on the test set.
-Uses rotation, resizing/cropping, and flipping for data augmentation
+Uses rotation, padding/cropping, and flipping for data augmentation
 The adam optimizer is used with an exponential decay learning rate schedule
 """
 
@@ -12,15 +12,20 @@ sys.path.append("..")
 import training_examples.helpers.tqdm_config # pyright: ignore
 from tqdm import trange
 
-import itertools
+from functools import partial
 import jax.numpy as jnp
 from jax import jit, grad, random
-from jax.tree_util import (tree_map, tree_flatten)
+from jax.tree_util import (tree_map, tree_reduce)
 import training_examples.helpers.datasets as datasets
+from training_examples.helpers.prefetch import prefetch
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
-from dm_pix import rotate, random_flip_left_right, resize_with_crop_or_pad, random_crop
 from nn import *
+from nn.activations.activations import elementwise
+
+# Let any remaining float32 convolutions (e.g. the accuracy evaluation) run their matrix multiplications in bfloat16
+# on hardware that supports it (e.g. TPUs and recent GPUs). Note this is a process wide setting.
+jax.config.update("jax_default_matmul_precision", "bfloat16")
 
 # ResNet blocks compose other layers
 def ConvBlock(kernel_size, filters, strides=(2, 2)):
@@ -39,79 +44,94 @@ def ConvBlock(kernel_size, filters, strides=(2, 2)):
     Shortcut = serial(Conv(filters3, (1, 1), strides), BatchNorm())
     return serial(FanOut(2), parallel(Main, Shortcut), FanInSum, Relu)
 
-def IdentityBlock(kernel_size, filters):
+def IdentityBlock(kernel_size, filters, in_channels):
     ks = kernel_size
     filters1, filters2 = filters
-
-    def make_main(input_shape):
-        # the number of output channels depends on the number of input channels
-        return serial(
-            Conv(filters1, (1, 1)),
-            BatchNorm(),
-            Relu,
-            Conv(filters2, (ks, ks), padding="SAME"),
-            BatchNorm(),
-            Relu,
-            Conv(input_shape[3], (1, 1)),
-            BatchNorm(),
-        )
-
-    Main = shape_dependent(make_main)
+    # The last convolution has to output the same number of channels as the block's input, so they can be summed with the identity.
+    # The input channels are passed in explicitly, so the block does not need shape_dependent to find them out during init.
+    Main = serial(
+        Conv(filters1, (1, 1)),
+        BatchNorm(),
+        Relu,
+        Conv(filters2, (ks, ks), padding="SAME"),
+        BatchNorm(),
+        Relu,
+        Conv(in_channels, (1, 1)),
+        BatchNorm(),
+    )
     return serial(FanOut(2), parallel(Main, Identity), FanInSum, Relu)
 
 
 # https://medium.com/analytics-vidhya/understanding-and-implementation-of-residual-networks-resnets-b80f9a507b9c
 def ResNet(num_classes):
-  return serial(
+  # The network is a body and a head. So the loss can run the body in bfloat16, and the final Dense and LogSoftmax in float32.
+  # The head starts by casting the pooled features back to float32.
+  body = serial(
         Conv(64, (3, 3), (1, 1), padding="SAME"),
         BatchNorm(), Relu,
-        IdentityBlock(3, [64, 64]),
-        IdentityBlock(3, [64, 64]),
+        IdentityBlock(3, [64, 64], 64),
+        IdentityBlock(3, [64, 64], 64),
         ConvBlock(3, [64, 64, 128]),
-        IdentityBlock(3, [128, 128]),
-        IdentityBlock(3, [128, 128]),
+        IdentityBlock(3, [128, 128], 128),
+        IdentityBlock(3, [128, 128], 128),
         ConvBlock(3, [128, 128, 256]),
-        IdentityBlock(3, [256, 256]),
-        IdentityBlock(3, [256, 256]),
+        IdentityBlock(3, [256, 256], 256),
+        IdentityBlock(3, [256, 256], 256),
         AvgPool((8, 8)),
         Flatten,
+    )
+  head = serial(
+        elementwise(jnp.asarray, dtype=jnp.float32),
         Dense(num_classes),
         LogSoftmax
     )
+  return serial(body, head)
 
-#   def init_fun(rng, input_shape):
-#     return make_layer(input_shape)[0](rng, input_shape)
-# For the above 'make_layer' is actually the 'make_main' function.
-# So only the input shape is passed in from the init_fun parameters.
-# Which resolves the stax.serial of 'make_main'. And finally the rng and input_shape are passed
-# into the resulting stax.serial which is returned by make_main.
-# This is necessary because we will not know the output shape of the identity block's previous layer until
-# the serial function does its init_fun execution to calculate the output sizes. This is because convolutional layers
-# only specify the number of output channels in the parameters and not their output shapes.
 
+@partial(jit, static_argnums=(4,))
+def accuracy(params, states, batch, rng, chunk_size=1000):
+    """Calculates accuracy (or percentage of correct guesses) for a given batch.
 
-def accuracy(params, states, batch, rng):
+    The batch is evaluated chunk_size images at a time with lax.map. So only a single chunk goes through the network at once,
+    and the whole batch is still a single call into XLA."""
     inputs, targets = batch
-    target_class = jnp.argmax(targets, axis=1)
-    predicted_class = jnp.argmax(net_predict(params, states, inputs, rng=rng, mode="test")[0], axis=1)
-    return jnp.mean(predicted_class == target_class)
-
-# (128, 32, 32, 3)
-@jit
-def augment(rng, batch):
-    # Generate the same number of keys as the array size.
-    subkeys = random.split(rng, batch.shape[0])
-    batch = batch * 255
-    # Randomly rotate the image https://dm-pix.readthedocs.io/en/latest/api.html#rotate
-    random_angles = jax.vmap(lambda x: jax.random.uniform(x, minval=-15, maxval=15), in_axes=(0), out_axes=0)(subkeys)
-    batch = jax.vmap(lambda array, angle : rotate(array, angle=(angle * (jnp.pi / 180))))(batch, random_angles)
-    # Resize to 36x36 then randomly crop the images back to 32x32
-    batch = jax.vmap(lambda array : resize_with_crop_or_pad(array, 36, 36, channel_axis=2))(batch)
-    batch = jax.vmap(lambda array, key : random_crop(key, array, (32, 32, 3)))(batch, subkeys)
-    # Randomly flip the image
-    batch = jax.vmap(lambda array, key : random_flip_left_right(key, array))(batch, subkeys)
-    batch = batch / 255
-    return batch
+    num_chunks = inputs.shape[0] // chunk_size
+
+    def correct_predictions(chunk):
+        inputs, targets = chunk
+        # The images are stored as bfloat16. The accuracy is evaluated with the float32 weights, so the inputs are cast to float32 to match.
+        predicted_class = jnp.argmax(net_predict(params, states, inputs.astype(jnp.float32), rng=rng, mode="test")[0], axis=1)
+        return jnp.sum(predicted_class == jnp.argmax(targets, axis=1))
+
+    chunks = tree_map(lambda x: x[: num_chunks * chunk_size].reshape(num_chunks, chunk_size, *x.shape[1:]), batch)
+    correct = jnp.sum(jax.lax.map(correct_predictions, chunks))
+    # Evaluate any images that do not fill a whole chunk separately.
+    if inputs.shape[0] % chunk_size:
+        correct += correct_predictions(tree_map(lambda x: x[num_chunks * chunk_size :], batch))
+    return correct / inputs.shape[0]
+
+# (128, 36, 36, 3) -> (128, 32, 32, 3)
+# The training images are padded to 36x36 once when they are loaded, so augment only has to crop them back to 32x32.
+# augment is not jitted on its own. It is called inside the jitted update, so XLA can fuse the augmentation into the start of the forward pass.
+def augment(rng, batch, group_size=8):
+    # Each random quantity gets its own key by folding a fixed index into rng. So there is no split of the key in the augmentation.
+    angle_rng, crop_rng, flip_rng = (random.fold_in(rng, i) for i in range(3))
+    # The images are augmented as bfloat16. Every augmentation below is linear in the pixel values, so they are not scaled up to 255 and back.
+    # Every augmentation below works on the whole batch at once, so there is no vmap over the individual images.
+    # Randomly rotate the images. The channels are moved in front of the height and width so each channel is rotated like a grayscale image.
+    # Every channel of an image shares that image's angle. The images are already padded, so the corners are filled with 0 like the padding.
+    random_angles = random.uniform(angle_rng, (batch.shape[0], 1), minval=-15, maxval=15)
+    batch = jnp.transpose(rotate_grayscale_image(jnp.transpose(batch, (0, 3, 1, 2)), random_angles), (0, 2, 3, 1))
+    # Randomly crop the padded images back to 32x32
+    # The crop offset and the flip are shared by each group of group_size images. So a batch of 128 only needs 16 dynamic slices instead of 128.
+    # The groups still get different offsets and flips, so most of the per-image randomness is kept. The batch size must be a multiple of group_size.
+    groups = batch.reshape(batch.shape[0] // group_size, group_size, *batch.shape[1:])
+    offsets = random.randint(crop_rng, (groups.shape[0], 2), 0, 5)
+    groups = jax.vmap(lambda group, offset : jax.lax.dynamic_slice(group, (0, offset[0], offset[1], 0), (group_size, 32, 32, 3)))(groups, offsets)
+    # Randomly flip the groups of images
+    flips = random.bernoulli(flip_rng, 0.5, (groups.shape[0],))
+    groups = jnp.where(flips[:, None, None, None, None], groups[:, :, :, ::-1, :], groups)
+    return groups.reshape(-1, 32, 32, 3)
 
 num_classes = 10
 net_init, net_predict = model_decorator(ResNet(num_classes))
@@ -122,16 +142,36 @@ def main():
     step_size = 0.001
     num_epochs = 40
     batch_size = 128
+    # The training steps run steps_per_scan at a time inside a single lax.scan. So Python only dispatches once per steps_per_scan steps.
+    # 390 batches per epoch = 13 scans of 30 steps.
+    steps_per_scan = 30
     # IMPORTANT
-    # If your network is larger and you test against the entire dataset for the accuracy.
-    # Then you will run out of RAM and get a std::bad_alloc error.
+    # If your network is larger and you pass too many images through it at once for the accuracy.
+    # Then you will run out of RAM and get a std::bad_alloc error. So the accuracy is calculated in chunks of this size.
     accuracy_batch_size = 1000
+    # The accuracy is only calculated on the first accuracy_subset_size images of the train and test sets, to keep each epoch fast.
+    # Set it to None to evaluate the entire datasets. The evaluation is chunked, so it still fits in memory, but it takes a lot longer.
+    accuracy_subset_size = 1000
+    # The accuracy is only calculated every accuracy_every_epochs epochs (and always after the last epoch).
+    # The highest accuracy (and the weights saved for it) only considers the epochs where it was calculated.
+    accuracy_every_epochs = 4
     grad_clip = 1.0
+    # Set this to a directory to keep the compiled train steps on disk. Later runs with the same shapes then skip the compile.
+    # The persistent compilation cache is only used on GPU and TPU backends.
+    compilation_cache_dir = None
 
     train_images, train_labels, test_images, test_labels = datasets.cifar10()
+    # Store the images on device as bfloat16. That halves the memory traffic of gathering and augmenting every batch.
+    train_images = jnp.asarray(train_images, dtype=jnp.bfloat16)
+    # Pad the training images to 36x36 once, rather than padding every batch. The random crop takes them back to 32x32.
+    train_images = jnp.pad(train_images, ((0, 0), (2, 2), (2, 2), (0, 0)))
+    test_images = jnp.asarray(test_images, dtype=jnp.bfloat16)
+    # Keep the labels on device as well, so the batches are shuffled and sliced without leaving the device.
+    train_labels = jnp.asarray(train_labels)
     num_train = train_images.shape[0]
-    num_complete_batches, leftover = divmod(num_train, batch_size)
-    num_batches = num_complete_batches + bool(leftover)
+    # Only complete scans of complete batches are used, so every scan stacks into a single array.
+    # The leftover images are different every epoch because of the shuffle.
+    num_scans = num_train // (batch_size * steps_per_scan)
 
     # Learning rate schedule that introduces exponential decay
     # https://keras.io/api/optimizers/learning_rate_schedules/exponential_decay/
@@ -143,36 +183,61 @@ def main():
     # https://github.com/google/jax/blob/7961fb81cf7643387c472ad51881332379f2893c/jax/example_libraries/optimizers.py#L571
     def l2_norm(tree):
         """Compute the l2 norm of a pytree of arrays. Useful for weight decay."""
-        leaves, _ = tree_flatten(tree)
-        return jnp.sqrt(sum(jnp.vdot(x, x) for x in leaves))
+        # Accumulate the sum of squares over the leaves with tree_reduce, starting from a float32 zero.
+        return jnp.sqrt(tree_reduce(lambda total, x: total + jnp.vdot(x, x), tree, jnp.float32(0.0)))
 
     def clip_grads(grad_tree, max_norm):
         """Clip gradients stored as a pytree of arrays to maximum norm `max_norm`."""
         norm = l2_norm(grad_tree)
-        normalize = lambda g: jnp.where(norm < max_norm, g, g * (max_norm / norm))
-        return tree_map(normalize, grad_tree)
+        # The scale is computed once and multiplied into every leaf. It is 1 when the norm is already below max_norm.
+        # The small epsilon keeps the division finite when every gradient is 0.
+        scale = jnp.minimum(1.0, max_norm / (norm + 1e-6))
+        return tree_map(lambda g: g * scale, grad_tree)
 
     def data_stream(rng):
         while True:
             rng, subkey = random.split(rng)
             perm = random.permutation(subkey, num_train)
-            for i in range(num_batches):
-                # batch_idx is a list of indices.
-                # That means this function yields an array of training images equal to the batch size when 'next' is called.
-                batch_idx = perm[i * batch_size : (i + 1) * batch_size]
+            # Gather the whole training set in shuffled order once per epoch. Every batch is then a contiguous slice of the shuffled copy,
+            # rather than a gather over the whole training set for every batch.
+            shuffled_images = jnp.take(train_images, perm, axis=0)
+            shuffled_labels = jnp.take(train_labels, perm, axis=0)
+            for i in range(num_scans):
+                # This function yields steps_per_scan stacked batches of training images when 'next' is called.
+                # The start index is a dynamic argument, so the same compiled slice is reused for every scan.
+                start = i * steps_per_scan * batch_size
+                images = jax.lax.dynamic_slice_in_dim(shuffled_images, start, steps_per_scan * batch_size)
+                labels = jax.lax.dynamic_slice_in_dim(shuffled_labels, start, steps_per_scan * batch_size)
                 rng, subkey = random.split(rng)
-                yield augment(subkey, train_images[batch_idx]), train_labels[batch_idx]
-
-    batches = data_stream(rng)
-    # 0.001 * (0.96 ^ ((num_batches * epochs) / 300))
+                # The batches are not augmented here. A key for each training step is passed along with them, and update augments each batch.
+                yield random.split(subkey, steps_per_scan), (
+                    images.reshape(steps_per_scan, batch_size, *images.shape[1:]),
+                    labels.reshape(steps_per_scan, batch_size, *labels.shape[1:]),
+                )
+
+    # Gather the next batches on a background thread while the current batches are training.
+    batches = prefetch(data_stream(rng), size=2)
+    # 0.001 * (0.96 ^ (step / 300))
     opt_init, opt_update, get_params = adam(exponential_decay(step_size, 0.96, 300))
 
-    @jit
-    def update(i, opt_state, states, batch):
+    def update(i, opt_state, states, batch, step_rng):
+        # Every step gets its own key, which is split between the augmentation and the network (e.g. for dropout).
+        # The key is an argument rather than a closure, so the network does not reuse the same key every step.
+        augment_rng, net_rng = random.split(step_rng)
+        # Augment the raw batch inside the same compiled step as the forward and backward pass.
+        inputs, targets = batch
+        batch = augment(augment_rng, inputs), targets
+
         def loss(params, states, batch):
             """Calculates the loss of the network as a single value / float"""
             inputs, targets = batch
-            predictions, states = net_predict(params, states, inputs, rng=rng)
+            # The body's forward and backward passes run in bfloat16, which halves the bytes moved by the convolution and batchnorm activations.
+            # The head (the final Dense and LogSoftmax) keeps its float32 params and casts its inputs back to float32, so the predictions are float32.
+            # The optimizer still holds float32 master weights, and the body's gradients are cast back to float32 by the astype.
+            # The batchnorm moving statistics also stay float32.
+            body_params, head_params = params
+            body_params, inputs = tree_map(lambda x: x.astype(jnp.bfloat16), (body_params, inputs))
+            predictions, states = net_predict([body_params, head_params], states, inputs, rng=net_rng)
             return categorical_cross_entropy(predictions, targets), states
 
         params = get_params(opt_state)
@@ -180,29 +245,61 @@ def main():
         # Clip gradients to prevent the exploding gradients
         grads = clip_grads(grads, grad_clip)
         return opt_update(i, grads, opt_state), states
-    
+
+    # The old optimizer state and states are never used after an update, so their buffers are donated to the new ones.
+    # That lets XLA update the adam moments and the batchnorm statistics in place, instead of keeping the old copies alive.
+    @partial(jit, donate_argnums=(1, 2))
+    def train_steps(i, opt_state, states, batches, step_rngs):
+        """Runs update over a stack of batches with lax.scan. So all of the steps are a single call into XLA."""
+        def train_step(carry, inputs):
+            i, opt_state, states = carry
+            batch, step_rng = inputs
+            opt_state, states = update(i, opt_state, states, batch, step_rng)
+            return (i + 1, opt_state, states), None
+
+        (i, opt_state, states), _ = jax.lax.scan(train_step, (i, opt_state, states), (batches, step_rngs))
+        return i, opt_state, states
+
     _, init_params, states = net_init(rng, (1, 32, 32, 3))
     opt_state = opt_init(init_params)
-    itercount = itertools.count()
+    # The step counter stays on device and is incremented inside the scan.
+    step = jnp.array(0, dtype=jnp.int32)
+
+    # Compile train_steps ahead of time for the exact shapes and dtypes that data_stream yields.
+    # The compile happens once before training, instead of stalling the first step. Any input with a different shape raises an error rather than silently recompiling.
+    if compilation_cache_dir is not None:
+        jax.config.update("jax_compilation_cache_dir", compilation_cache_dir)
+    example_batches = (
+        jax.ShapeDtypeStruct((steps_per_scan, batch_size, *train_images.shape[1:]), train_images.dtype),
+        jax.ShapeDtypeStruct((steps_per_scan, batch_size, *train_labels.shape[1:]), train_labels.dtype),
+    )
+    example_step_rngs = jax.ShapeDtypeStruct((steps_per_scan, *rng.shape), rng.dtype)
+    compiled_train_steps = train_steps.lower(step, opt_state, states, example_batches, example_step_rngs).compile()
 
     print("Starting training...")
     highest_train_acc = 0
     highest_test_acc = 0
-    highest_opt_state, highest_states = opt_state, states
+    # The snapshots are copies. The buffers of opt_state and states are donated to train_steps, so they are invalid after the next call.
+    highest_opt_state, highest_states = tree_map(jnp.copy, (opt_state, states))
     for epoch in (t := trange(num_epochs)):
-        for batch in range(num_batches):
-            opt_state, states = update(next(itercount), opt_state, states, next(batches))
+        for _ in range(num_scans):
+            step_rngs, batches_to_train = next(batches)
+            step, opt_state, states = compiled_train_steps(step, opt_state, states, batches_to_train, step_rngs)
+
+        if epoch % accuracy_every_epochs != 0 and epoch != num_epochs - 1:
+            continue
 
         params = get_params(opt_state)
-        train_acc = accuracy(params, states, (train_images[:accuracy_batch_size], train_labels[:accuracy_batch_size]), rng)
-        test_acc = accuracy(params, states, (test_images[:accuracy_batch_size], test_labels[:accuracy_batch_size]), rng)
+        # The training images are padded, so the center 32x32 crop is the original image.
+        train_acc = accuracy(params, states, (train_images[:accuracy_subset_size, 2:-2, 2:-2], train_labels[:accuracy_subset_size]), rng, accuracy_batch_size)
+        test_acc = accuracy(params, states, (test_images[:accuracy_subset_size], test_labels[:accuracy_subset_size]), rng, accuracy_batch_size)
         # Track the highest accuracy achieved
         if train_acc > highest_train_acc:
             highest_train_acc = train_acc
         if test_acc > highest_test_acc:
             # Save the highest weights for predictions
             highest_test_acc = test_acc
-            highest_opt_state, highest_states = opt_state, states
+            highest_opt_state, highest_states = tree_map(jnp.copy, (opt_state, states))
         t.set_description_str("Accuracy Train = {:.2%}, Accuracy Test = {:.2%}".format(train_acc, test_acc))
     print("Training Complete.")
     print(f"Highest Train Accuracy {highest_train_acc:.2%}")
@@ -240,15 +337,21 @@ def visual_debug(params, states, test_images, test_labels, rng, starting_index=0
             self.starting_index = starting_index
         
         def render_images(self):
-            i = self.starting_index
+            # Predict every displayed image with a single batch, rather than one image at a time.
+            # The indices wrap around, so paging before the first image or past the last image still works.
+            indices = jnp.arange(self.starting_index, self.starting_index + (rows * columns)) % test_images.shape[0]
+            images = jnp.take(test_images, indices, axis=0).astype(jnp.float32)
+            output = net_predict(params, states, images, rng=rng, mode="test")[0]
+            # Copy the results to the host once. The loop below only does plotting.
+            images, predictions, targets = jax.device_get((images, jnp.argmax(output, axis=1), jnp.argmax(jnp.take(test_labels, indices, axis=0), axis=1)))
+            i = 0
             for j in range(rows):
                 for k in range(columns):
-                    output = net_predict(params, states, test_images[i].reshape(1, *test_images[i].shape), rng=rng, mode="test")[0]
-                    prediction = int(jnp.argmax(output, axis=1)[0])
-                    target = int(jnp.argmax(test_labels[i], axis=0))
+                    prediction = int(predictions[i])
+                    target = int(targets[i])
                     prediction_color = "green" if prediction == target else "red"
                     axes[j][k].set_title(cifar_dict[prediction], fontsize = 10, color=prediction_color)
-                    axes[j][k].imshow(test_images[i])
+                    axes[j][k].imshow(images[i])
                     axes[j][k].get_xaxis().set_visible(False)
                     axes[j][k].get_yaxis().set_visible(False)
                     i += 1